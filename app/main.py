@@ -1,16 +1,61 @@
-from fastapi import FastAPI, Depends, Query, HTTPException
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Depends, Header, Query, Request, Response, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import func
 from datetime import datetime, timedelta
+import asyncio
+import hashlib
 import os
+import random
+import zlib
 import httpx
+import msgspec
+import orjson
+import redis.asyncio as aioredis
+from cachetools import TTLCache
 from urllib.parse import urlencode
 
-from .db import SessionLocal, engine, Base
+from .db import AsyncSessionLocal, engine, Base
 from .models import FlipCard, Tip
 
-app = FastAPI(title="Brain Health API", version="1.0.0")
+# Optional shared cache: with multiple uvicorn workers each process has
+# its own in-memory cache, so cold keys hit Open-Meteo once per worker.
+# Pointing REDIS_URL at a Redis instance makes the 10-minute cache
+# shared; the in-process cache then acts as a short-lived L1.
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+# One client for the whole app lifetime: keep-alive connections to
+# Open-Meteo are reused instead of a TCP+TLS handshake per request.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.http = httpx.AsyncClient(
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    )
+    app.state.redis = aioredis.from_url(REDIS_URL) if REDIS_URL else None
+    try:
+        await _load_flip_cards()
+    except Exception as e:
+        # Tables may not exist yet (schema job still running); the lazy
+        # reload in get_flip_cards picks them up once they do.
+        print(f"Flip-card preload skipped: {e}")
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
+        if app.state.redis is not None:
+            await app.state.redis.aclose()
+
+app = FastAPI(
+    title="Brain Health API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 # --- optional speech router ---
 ENABLE_SPEECH = os.getenv("ENABLE_SPEECH", "0") == "1"
@@ -21,8 +66,11 @@ if ENABLE_SPEECH:
     except Exception as e:
         print(f"Speech router disabled: {e}")
 
-# Create tables if not exist
-Base.metadata.create_all(bind=engine)
+# Dev convenience only: DDL introspection on every worker boot is slow
+# and races under autoscaling. Production schemas come from running
+# app/seed_data.py (or a migration) as a pre-start job.
+if os.getenv("AUTO_CREATE_ALL", "0") == "1":
+    Base.metadata.create_all(bind=engine)
 
 # ---- CORS ----
 origins = os.getenv("CORS_ORIGINS", "*")
@@ -36,12 +84,9 @@ app.add_middleware(
 )
 
 # ---- DB session dependency ----
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 # ---- Health ----
 @app.get("/health")
@@ -49,54 +94,148 @@ def health():
     return {"status": "ok", "time": datetime.utcnow().isoformat()}
 
 # ---- Flip cards ----
+# Seed content is tiny and effectively immutable, so it is loaded once at
+# startup and served from memory; reloaded lazily only while the table is
+# still empty (e.g. seeded after boot). Past the snapshot cap the rows
+# stay in the DB and get_flip_cards samples them SQL-side instead.
+_FLIP_CARD_SNAPSHOT_MAX = 200
+_flip_card_count = 0
+
+class FlipCardOut(msgspec.Struct):
+    id: int
+    negative_text: str
+    positive_text: str
+    tag: str | None
+
+_FLIP_CARDS: tuple[FlipCardOut, ...] = ()
+
+def _flip_card_out(r) -> FlipCardOut:
+    return FlipCardOut(r.id, r.negative_text, r.positive_text, r.tag)
+
+# tsm_system_rows availability, probed on first use (seed_data.py tries
+# to CREATE EXTENSION it, but that needs superuser).
+_tsm_system_rows: bool | None = None
+
+def _has_tsm_system_rows() -> bool:
+    return _tsm_system_rows is not False
+
+def _flip_cards_response(items: list[FlipCardOut]) -> Response:
+    # msgspec encodes the structs straight to JSON bytes — no per-row
+    # dicts and no Pydantic validation pass on the way out.
+    return Response(content=msgspec.json.encode(items), media_type="application/json")
+
+async def _load_flip_cards() -> tuple[FlipCardOut, ...]:
+    global _FLIP_CARDS, _flip_card_count
+    async with AsyncSessionLocal() as db:
+        _flip_card_count = await db.scalar(select(func.count(FlipCard.id))) or 0
+        if _flip_card_count <= _FLIP_CARD_SNAPSHOT_MAX:
+            result = await db.execute(select(FlipCard))
+            _FLIP_CARDS = tuple(_flip_card_out(r) for r in result.scalars())
+        else:
+            _FLIP_CARDS = ()
+    return _FLIP_CARDS
+
 @app.get("/api/flip-cards")
-def get_flip_cards(
+async def get_flip_cards(
     limit: int = Query(12, ge=1, le=100),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    rows = db.query(FlipCard).order_by(func.random()).limit(limit).all()
-    return [
-        {
-            "id": r.id,
-            "negative_text": r.negative_text,
-            "positive_text": r.positive_text,
-            "tag": r.tag,
-        }
-        for r in rows
-    ]
+    if _FLIP_CARDS or _flip_card_count == 0:
+        cards = _FLIP_CARDS or await _load_flip_cards()
+        return _flip_cards_response(random.sample(cards, min(limit, len(cards))))
+
+    if engine.dialect.name == "postgresql":
+        rows = []
+        if _has_tsm_system_rows():
+            # SYSTEM_ROWS reads random heap blocks and stops after exactly
+            # n rows — O(limit) regardless of table size. Blockwise
+            # randomness is fine for flip cards.
+            try:
+                result = await db.execute(
+                    text(
+                        "SELECT id, negative_text, positive_text, tag "
+                        "FROM flip_card TABLESAMPLE SYSTEM_ROWS(:n)"
+                    ),
+                    {"n": limit},
+                )
+                rows = result.all()
+            except Exception:
+                # Extension not installed on this database; remember and
+                # stay on the Bernoulli path.
+                await db.rollback()
+                global _tsm_system_rows
+                _tsm_system_rows = False
+        if not rows:
+            # Bernoulli sampling skips heap pages before any sort;
+            # oversample 3x so the LIMIT is usually satisfied in one pass.
+            p = min(100.0, 100.0 * 3 * limit / _flip_card_count)
+            result = await db.execute(
+                text(
+                    "SELECT id, negative_text, positive_text, tag "
+                    "FROM flip_card TABLESAMPLE BERNOULLI(:p) LIMIT :lim"
+                ),
+                {"p": p, "lim": limit},
+            )
+            rows = result.all()
+        if len(rows) >= min(limit, _flip_card_count):
+            return _flip_cards_response([_flip_card_out(r) for r in rows])
+
+    # Unlucky sample or non-Postgres backend: one full-table sort.
+    result = await db.execute(select(FlipCard).order_by(func.random()).limit(limit))
+    return _flip_cards_response([_flip_card_out(r) for r in result.scalars()])
 
 # ---- Tips (DB) ----
+# Tip ids grouped by mood_tag and cached for 60s: picking a tip becomes
+# random.choice + one PK lookup, with no second full-table query when a
+# mood has no rows.
+_TIP_IDS_TTL_SECONDS = 60
+_tip_ids_cache: tuple[dict[str | None, list[int]], datetime] | None = None
+
+async def _tip_ids_by_mood(db: AsyncSession) -> dict[str | None, list[int]]:
+    global _tip_ids_cache
+    if _tip_ids_cache and datetime.utcnow() < _tip_ids_cache[1]:
+        return _tip_ids_cache[0]
+    ids: dict[str | None, list[int]] = {None: []}
+    result = await db.execute(select(Tip.id, Tip.mood_tag))
+    for tip_id, mood_tag in result:
+        ids[None].append(tip_id)
+        if mood_tag is not None:
+            ids.setdefault(mood_tag, []).append(tip_id)
+    _tip_ids_cache = (ids, datetime.utcnow() + timedelta(seconds=_TIP_IDS_TTL_SECONDS))
+    return ids
+
 @app.get("/api/tips/random")
-def random_tip(mood: str | None = None, db: Session = Depends(get_db)):
-    q = db.query(Tip)
-    if mood:
-        q = q.filter(Tip.mood_tag == mood)
-    row = q.order_by(func.random()).first() or db.query(Tip).order_by(func.random()).first()
+async def random_tip(mood: str | None = None, db: AsyncSession = Depends(get_db)):
+    ids_by_mood = await _tip_ids_by_mood(db)
+    ids = ids_by_mood.get(mood) or ids_by_mood[None]
+    if not ids:
+        raise HTTPException(status_code=404, detail="No tips seeded")
+    row = await db.get(Tip, random.choice(ids))
     if not row:
         raise HTTPException(status_code=404, detail="No tips seeded")
     return {"id": row.id, "text": row.text, "mood": row.mood_tag}
 
 # ---- Simple in-memory cache ----
+# Bounded LRU+TTL so unique (lat,lon) pairs can't grow memory without limit.
+# Entries are (data, etag) so conditional requests can skip the body.
 _TTL_SECONDS = 600
-_cache: dict[str, tuple[dict, datetime]] = {}
+_L1_TTL_SECONDS = 30  # keep the per-process copy short when Redis is authoritative
+_CACHE_CONTROL = f"public, max-age={_TTL_SECONDS}"
+_cache: TTLCache = TTLCache(maxsize=4096, ttl=_L1_TTL_SECONDS if REDIS_URL else _TTL_SECONDS)
 
 def _cache_get(key: str):
-    hit = _cache.get(key)
-    if not hit:
-        return None
-    data, exp = hit
-    if datetime.utcnow() > exp:
-        _cache.pop(key, None)
-        return None
-    return data
+    return _cache.get(key)
 
-def _cache_set(key: str, data: dict):
-    _cache[key] = (data, datetime.utcnow() + timedelta(seconds=_TTL_SECONDS))
+def _cache_set(key: str, data: dict) -> str:
+    digest = hashlib.blake2b(
+        orjson.dumps(data, option=orjson.OPT_SORT_KEYS),
+        digest_size=16,
+    ).hexdigest()
+    etag = f'"{digest}"'
+    _cache[key] = (data, etag)
+    return etag
 
 # ---- Helpers ----
-def _httpx_client():
-    return httpx.AsyncClient(timeout=10.0)
-
 def _cache_key(prefix: str, base_url: str, params: dict) -> str:
     return f"{prefix}:{base_url}?{urlencode(sorted(params.items()))}"
 
@@ -108,9 +247,83 @@ def _raise_as_http(e: httpx.HTTPStatusError):
         detail["body"] = e.response.text
     raise HTTPException(status_code=e.response.status_code, detail=detail)
 
+# L2 cache in Redis (compressed orjson bytes). Redis being down must
+# never break the endpoints, so errors degrade to an upstream fetch.
+async def _redis_get(r, key: str) -> dict | None:
+    if r is None:
+        return None
+    try:
+        raw = await r.get(key)
+    except Exception:
+        return None
+    return orjson.loads(zlib.decompress(raw)) if raw is not None else None
+
+async def _redis_set(r, key: str, data: dict) -> None:
+    if r is None:
+        return
+    try:
+        await r.setex(key, _TTL_SECONDS, zlib.compress(orjson.dumps(data)))
+    except Exception:
+        pass
+
+# Coalesce concurrent misses on the same key: only the first coroutine
+# hits the upstream, the rest await its future (singleflight).
+_inflight: dict[str, asyncio.Future] = {}
+
+async def _fetch_cached(request: Request, prefix: str, base: str, params: dict) -> tuple[str, dict, str]:
+    """Return ("cache"|"live", data, etag) for an upstream GET,
+    deduplicating concurrent fetches of the same key."""
+    key = _cache_key(prefix, base, params)
+    cached = _cache_get(key)
+    if cached is not None:
+        data, etag = cached
+        return "cache", data, etag
+
+    fut = _inflight.get(key)
+    if fut is not None:
+        try:
+            data, etag = await asyncio.shield(fut)
+            return "live", data, etag
+        except httpx.HTTPStatusError as e:
+            _raise_as_http(e)
+
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = fut
+    try:
+        data = await _redis_get(request.app.state.redis, key)
+        if data is not None:
+            etag = _cache_set(key, data)
+            fut.set_result((data, etag))
+            _inflight.pop(key, None)
+            return "cache", data, etag
+        client: httpx.AsyncClient = request.app.state.http
+        r = await client.get(base, params=params)
+        r.raise_for_status()
+        data = orjson.loads(r.content)
+    except BaseException as e:
+        fut.set_exception(e)
+        fut.exception()  # consume so cancellation isn't logged as unretrieved
+        _inflight.pop(key, None)
+        if isinstance(e, httpx.HTTPStatusError):
+            _raise_as_http(e)
+        raise
+    etag = _cache_set(key, data)
+    fut.set_result((data, etag))
+    _inflight.pop(key, None)
+    await _redis_set(request.app.state.redis, key, data)
+    return "live", data, etag
+
+def _conditional_headers(response: Response, etag: str, if_none_match: str | None) -> Response | None:
+    """Stamp ETag/Cache-Control on the response; return a 304 when the
+    client already holds the current body."""
+    if if_none_match is not None and etag in if_none_match:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": _CACHE_CONTROL})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = _CACHE_CONTROL
+    return None
+
 # Open-Meteo (forecast) → UV + current
-@app.get("/api/open-meteo")
-async def open_meteo(lat: float = Query(...), lon: float = Query(...)):
+async def _fetch_meteo(request: Request, lat: float, lon: float) -> tuple[dict, str]:
     base = "https://api.open-meteo.com/v1/forecast"
     params = {
         "latitude": lat,
@@ -119,35 +332,29 @@ async def open_meteo(lat: float = Query(...), lon: float = Query(...)):
         "hourly": "uv_index,uv_index_clear_sky,is_day",
         "timezone": "auto",
     }
-    key = _cache_key("meteo", base, params)
-    cached = _cache_get(key)
-    if cached:
-        return {
-            "source": "cache",
-            "data": cached,              # AC: 原始 data
-            "current": cached.get("current", {}),
-            "hourly": cached.get("hourly", {}),
-        }
-
-    async with _httpx_client() as client:
-        try:
-            r = await client.get(base, params=params)
-            r.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            _raise_as_http(e)
-        data = r.json()
-
-    _cache_set(key, data)
+    source, data, etag = await _fetch_cached(request, "meteo", base, params)
     return {
-        "source": "live",
-        "data": data,
+        "source": source,
+        "data": data,                # AC: 原始 data
         "current": data.get("current", {}),
         "hourly": data.get("hourly", {}),
-    }
+    }, etag
+
+@app.get("/api/open-meteo")
+async def open_meteo(
+    request: Request,
+    response: Response,
+    lat: float = Query(...),
+    lon: float = Query(...),
+    if_none_match: str | None = Header(default=None),
+):
+    payload, etag = await _fetch_meteo(request, lat, lon)
+    if not_modified := _conditional_headers(response, etag, if_none_match):
+        return not_modified
+    return payload
 
 # Air quality → PM2.5
-@app.get("/api/air-quality")
-async def air_quality(lat: float = Query(...), lon: float = Query(...)):
+async def _fetch_aq(request: Request, lat: float, lon: float) -> tuple[dict, str]:
     base = "https://air-quality-api.open-meteo.com/v1/air-quality"
     params = {
         "latitude": lat,
@@ -155,33 +362,28 @@ async def air_quality(lat: float = Query(...), lon: float = Query(...)):
         "hourly": "pm2_5,pm10,ozone",
         "timezone": "auto",
     }
-    key = _cache_key("aq", base, params)
-    cached = _cache_get(key)
-    if cached:
-        return {
-            "source": "cache",
-            "data": cached,
-            "hourly": cached.get("hourly", {}),
-        }
-
-    async with _httpx_client() as client:
-        try:
-            r = await client.get(base, params=params)
-            r.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            _raise_as_http(e)
-        data = r.json()
-
-    _cache_set(key, data)
+    source, data, etag = await _fetch_cached(request, "aq", base, params)
     return {
-        "source": "live",
+        "source": source,
         "data": data,
         "hourly": data.get("hourly", {}),
-    }
+    }, etag
+
+@app.get("/api/air-quality")
+async def air_quality(
+    request: Request,
+    response: Response,
+    lat: float = Query(...),
+    lon: float = Query(...),
+    if_none_match: str | None = Header(default=None),
+):
+    payload, etag = await _fetch_aq(request, lat, lon)
+    if not_modified := _conditional_headers(response, etag, if_none_match):
+        return not_modified
+    return payload
 
 # Daylight → sunrise/sunset
-@app.get("/api/daylight")
-async def daylight(lat: float = Query(...), lon: float = Query(...)):
+async def _fetch_dl(request: Request, lat: float, lon: float) -> tuple[dict, str]:
     base = "https://api.open-meteo.com/v1/forecast"
     params = {
         "latitude": lat,
@@ -189,34 +391,52 @@ async def daylight(lat: float = Query(...), lon: float = Query(...)):
         "daily": "sunrise,sunset",
         "timezone": "auto",
     }
-    key = _cache_key("dl", base, params)
-    cached = _cache_get(key)
-    if cached:
-        return {
-            "source": "cache",
-            "data": cached,
-            "daily": cached.get("daily", {}),
-        }
-
-    async with _httpx_client() as client:
-        try:
-            r = await client.get(base, params=params)
-            r.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            _raise_as_http(e)
-        data = r.json()
-
-    _cache_set(key, data)
+    source, data, etag = await _fetch_cached(request, "dl", base, params)
     return {
-        "source": "live",
+        "source": source,
         "data": data,
         "daily": data.get("daily", {}),
-    }
+    }, etag
+
+@app.get("/api/daylight")
+async def daylight(
+    request: Request,
+    response: Response,
+    lat: float = Query(...),
+    lon: float = Query(...),
+    if_none_match: str | None = Header(default=None),
+):
+    payload, etag = await _fetch_dl(request, lat, lon)
+    if not_modified := _conditional_headers(response, etag, if_none_match):
+        return not_modified
+    return payload
+
+# All three sources for the same coordinates in one round-trip: the
+# upstream fetches run concurrently and each section fails independently.
+@app.get("/api/weather-bundle")
+async def weather_bundle(request: Request, lat: float = Query(...), lon: float = Query(...)):
+    results = await asyncio.gather(
+        _fetch_meteo(request, lat, lon),
+        _fetch_aq(request, lat, lon),
+        _fetch_dl(request, lat, lon),
+        return_exceptions=True,
+    )
+    out = {}
+    for name, res in zip(("meteo", "air_quality", "daylight"), results):
+        if isinstance(res, HTTPException):
+            out[name] = {"error": res.detail}
+        elif isinstance(res, BaseException):
+            out[name] = {"error": str(res)}
+        else:
+            out[name] = res[0]
+    return out
 
 # ---- DB stats ----
 @app.get("/api/db-stats")
-def db_stats(db: Session = Depends(get_db)):
-    return {
-        "flip_card": db.query(FlipCard).count(),
-        "tip": db.query(Tip).count(),
-    }
+async def db_stats(db: AsyncSession = Depends(get_db)):
+    # Both counts in one round-trip instead of two sequential queries.
+    result = await db.execute(
+        text("SELECT (SELECT count(*) FROM flip_card) AS fc, (SELECT count(*) FROM tip) AS tips")
+    )
+    row = result.one()
+    return {"flip_card": row.fc, "tip": row.tips}
@@ -1,5 +1,5 @@
 import argparse
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from .db import Base, engine as target_engine, SessionLocal
 from .models import FlipCard, Tip
@@ -43,8 +43,6 @@ def migrate_from_sqlite(sqlite_path: str):
     src = SrcSession()
     dst = SessionLocal()
 
-    Base.metadata.create_all(bind=target_engine)
-
     # FlipCard
     for r in src.query(FlipCard).all():
         if not dst.query(FlipCard).filter_by(id=r.id).first():
@@ -63,6 +61,14 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     Base.metadata.create_all(bind=target_engine)
+    if target_engine.dialect.name == "postgresql":
+        # Lets the API sample random rows in O(n) via TABLESAMPLE SYSTEM_ROWS.
+        try:
+            with target_engine.connect() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS tsm_system_rows"))
+                conn.commit()
+        except Exception as e:
+            print(f"tsm_system_rows extension not installed: {e}")
     if args.migrate_from_sqlite:
         migrate_from_sqlite(args.migrate_from_sqlite)
     else:
@@ -1,33 +1,43 @@
-import os, tempfile
+import io
 import numpy as np
 import soundfile as sf
 from fastapi import APIRouter, UploadFile, File, HTTPException
 
 router = APIRouter(prefix="/api/speech", tags=["speech"])
 
-def rms_flags(y: np.ndarray, sr: int, frame_ms: int = 30, thresh_scale: float = 0.6):
-    """Energy-threshold method: determine per frame whether it is 'speech' (True) or 'silence' (False)."""
+def rms_flags(y: np.ndarray, sr: int, frame_ms: int = 30, thresh_scale: float = 0.6) -> np.ndarray:
+    """Energy-threshold method: bool array, one entry per frame — 'speech' (True) or 'silence' (False)."""
     frame_len = max(1, int(sr * frame_ms / 1000))
     n_frames = len(y) // frame_len
     if n_frames == 0:
-        return []
-    y = y[: n_frames * frame_len]
-    frames = y.reshape(n_frames, frame_len)
-    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+        return np.zeros(0, dtype=bool)
+    frames = y[: n_frames * frame_len].reshape(n_frames, frame_len)
+    # Fused multiply-accumulate: no materialized frames**2 intermediate
+    if np.issubdtype(frames.dtype, np.integer):
+        # int16 PCM path: accumulate in int64 (no overflow), scale to [-1, 1]
+        energy = np.einsum("ij,ij->i", frames, frames, dtype=np.int64)
+        rms = np.sqrt(energy * (1.0 / frame_len)) / 32768.0
+    else:
+        energy = np.einsum("ij,ij->i", frames, frames)
+        rms = np.sqrt(energy * (1.0 / frame_len))
     thr = max(1e-12, float(np.median(rms) * thresh_scale))
-    return (rms > thr).astype(bool).tolist()
+    return rms > thr
 
 @router.post("/analyze")
 async def analyze(file: UploadFile = File(...)):
-    # 1) Save temporary file
-    suffix = os.path.splitext(file.filename or "")[1] or ".wav"
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        tmp.write(await file.read())
-        path = tmp.name
+    # 1) Buffer upload in chunks (no temp file, no second full copy)
+    bio = io.BytesIO()
+    while chunk := await file.read(65536):
+        bio.write(chunk)
+    if bio.tell() == 0:
+        raise HTTPException(400, "Empty audio")
+    bio.seek(0)
 
     try:
-        # 2) Read audio (keep original sample rate)
-        y, sr = sf.read(path, dtype="float32", always_2d=False)
+        # 2) Read audio (keep original sample rate); libsndfile decodes
+        #    straight from the in-memory buffer via virtual IO. int16
+        #    keeps 16-bit PCM (the common case) at half the buffer size.
+        y, sr = sf.read(bio, dtype="int16", always_2d=False)
         if y is None or len(y) == 0:
             raise HTTPException(400, "Empty audio")
         if y.ndim > 1:
@@ -35,21 +45,17 @@ async def analyze(file: UploadFile = File(...)):
 
         # 3) Compute speech/silence frames
         flags = rms_flags(y, sr, frame_ms=30, thresh_scale=0.6)
-        total_ms = len(flags) * 30
+        total_ms = int(flags.size) * 30
 
-        # Collect silence segments
+        # Collect silence segments: find run boundaries with diff instead
+        # of scanning frame by frame in Python
         pauses = []
-        if flags:
-            run = 1
-            for i in range(1, len(flags)):
-                if flags[i] == flags[i - 1]:
-                    run += 1
-                else:
-                    if not flags[i - 1]:           # just finished a silence block
-                        pauses.append(run * 30)    # ms
-                    run = 1
-            if not flags[-1]:
-                pauses.append(run * 30)
+        if flags.size:
+            changes = np.flatnonzero(np.diff(flags.astype(np.int8))) + 1
+            edges = np.concatenate(([0], changes, [flags.size]))
+            runs = np.diff(edges)
+            is_silence = ~flags[edges[:-1]]
+            pauses = (runs[is_silence] * 30).tolist()  # ms
 
         mean_pause = float(np.mean(pauses)) if pauses else 0.0
         long_pause_pct = int(100 * sum(p > 700 for p in pauses) / max(1, len(pauses)))
@@ -64,7 +70,4 @@ async def analyze(file: UploadFile = File(...)):
             "disclaimer": "For educational purposes only, not for medical diagnosis.",
         }
     finally:
-        try:
-            os.remove(path)
-        except:
-            pass
+        bio.close()